@@ -21,38 +21,66 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
+import os
 import sys
+import shutil
+import tempfile
+import hashlib
 from datetime import datetime
 import numpy as np
-import matplotlib.pyplot as plt
+
+_OCTAVE_BANDS = np.array([63, 125, 250, 500, 1000, 2000, 4000, 8000])
+""" Frequencies for plot"""
+_LEVEL_MAT = np.array([
+    [47, 36, 29, 22, 17, 14, 12, 11],
+    [51, 40, 33, 26, 22, 19, 17, 16],
+    [54, 44, 37, 31, 27, 24, 22, 21],
+    [57, 48, 41, 35, 31, 29, 28, 27],
+    [60, 52, 45, 40, 36, 34, 33, 32],
+    [64, 56, 50, 45, 41, 39, 38, 37],
+    [67, 60, 54, 49, 46, 44, 43, 42],
+    [71, 64, 58, 54, 51, 49, 48, 47],
+    [74, 67, 62, 58, 56, 54, 53, 52],
+    [77, 71, 67, 63, 61, 59, 58, 57],
+], dtype=np.int8, order="F")
+""" NC curve by L.L.Beranek, column-major so each octave band is contiguous"""
+_LEVEL_MAT.flags.writeable = False
+assert (np.diff(_LEVEL_MAT, axis=0) > 0).all(), "NC curves must rise monotonically in every band"
+_OCTAVE_BANDS.flags.writeable = False
+_LEVELS = tuple(f"NC-{i}" for i in range(15, 65, 5))
+""" Names of noise levels"""
+_HR = '-' * 72
+""" Horizontal rule of the text report"""
+_HEADER = f"{'':>7}" + " ".join(f"{band:>6}" for band in _OCTAVE_BANDS)
+""" Header line of the text table"""
+_ROW_PREFIXES = tuple(f"{level:>7}" for level in _LEVELS)
+""" Level labels of the text table rows"""
+_LEVEL_TEXT = np.char.mod("%6.1f", _LEVEL_MAT)
+""" Formatted NC curve values of the text table"""
+_FLAG_CHARS = str.maketrans("01", " *")
+""" Table flag for each bit of the Data >= NC plot mask"""
+_PLOT_DPI = 300
+""" Resolution of saved plots"""
+_PLOT_VERSION = 1
+""" Version of the plot layout in plot_mat(), part of the plot cache key; bump on any change"""
+_PLOT_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+                               "pynoisecriteria")
+""" User cache directory of rendered plots, used by the command line"""
 
 class NC_table:
     """
     Class contains NC curves and methods for estimation
     Call input_levels() method to input noise level at each frequency
-    L.L.Beranek, J. Acoust. Soc. Amer. 25, 313-321 (1953)    
+    L.L.Beranek, J. Acoust. Soc. Amer. 25, 313-321 (1953)
     """
+    __slots__ = ("_gt_bits", "data", "filename", "nc_level", "freqs")
+
     def __init__(self, loadfile=None):
         """
         Initialize NC curve
         """
-        self.octave_bands = np.array([63, 125, 250, 500, 1000, 2000, 4000, 8000])
-        """ Frequencies for plot"""
-        self.level_mat = np.array([
-            [47, 36, 29, 22, 17, 14, 12, 11],
-            [51, 40, 33, 26, 22, 19, 17, 16],
-            [54, 44, 37, 31, 27, 24, 22, 21],
-            [57, 48, 41, 35, 31, 29, 28, 27],
-            [60, 52, 45, 40, 36, 34, 33, 32],
-            [64, 56, 50, 45, 41, 39, 38, 37],
-            [67, 60, 54, 49, 46, 44, 43, 42],
-            [71, 64, 58, 54, 51, 49, 48, 47],
-            [74, 67, 62, 58, 56, 54, 53, 52],
-            [77, 71, 67, 63, 61, 59, 58, 57],
-        ], dtype=float)
-        """ NC curve by L.L.Beranek"""
-        self.levels = ["NC-"+str(i) for i in range(15,65,5)]
-        """ Names of noise levels"""
+        self._gt_bits = 0
+        """ Condition Data >= NC plot packed into an int, one bit per cell in row order, set by calculate()"""
 
         if loadfile:
             self.load(loadfile)
@@ -61,29 +89,47 @@ class NC_table:
             self.data = None
             self.filename = None
         """ User input data"""
-    
+
+    # The NC table is shared and read-only; the text table is precomputed from it
+    @property
+    def octave_bands(self):
+        """ Frequencies for plot"""
+        return _OCTAVE_BANDS
+
+    @property
+    def level_mat(self):
+        """ NC curve by L.L.Beranek"""
+        return _LEVEL_MAT
+
+    @property
+    def levels(self):
+        """ Names of noise levels"""
+        return _LEVELS
+
     def input_levels(self):
         """
         Estimate NC level by noise level at octave-bands by interactive way.
         """
-        input_data = []
         print("Input noise level.")
-        # Input noise levels from user
-        for band in self.octave_bands:
-            l = float(input(f"Level at {band}Hz: "))
-            if l >= 0:
-                input_data.append(l)
-        self.data = np.array(input_data,dtype=float)
-        
+        # Input noise levels from user in one line, separated by spaces or commas
+        bands = " ".join(str(band) for band in self.octave_bands)
+        raw = input(f"Levels at {bands} Hz: ")
+        input_data = np.array(raw.replace(",", " ").split(), dtype=float)
+        if len(input_data) != len(self.octave_bands):
+            raise ValueError(f"Expected {len(self.octave_bands)} levels, got {len(input_data)}.")
+        if (input_data < 0).any():
+            raise ValueError("Noise levels must not be negative.")
+        self.data = input_data
+
         now = datetime.now()
         timestamp = now.strftime("%Y%m%d-%H%M%S")
         self.filename = f"{timestamp}-NC-criteria"
         
         self.save(self.filename + '.csv')
 
-    def calculate_levels(self):
+    def calculate_levels(self, cache_dir=None):
         self.calculate()
-        report = self.print_text_table()        
+        report = self.print_text_table()
         print(report)
         self.hr()
         print(f"NC level: {self.nc_level}")
@@ -91,75 +137,155 @@ class NC_table:
         for f in self.freqs:
             print(f"  Maximum level at {self.octave_bands[f]} Hz")
         self.hr()
-        self.plot_mat(overlay_ar=self.data, filename=self.filename+'.png')
+        self.plot_mat(overlay_ar=self.data, filename=self.filename+'.png', cache_dir=cache_dir)
         
 
     def load(self, filename):
-        loaddata = np.loadtxt(filename, delimiter=",", skiprows=1)
-        self.data = loaddata.T[1]
+        # Two-column CSV with a header line; only the noise level column is kept
+        levels = []
+        with open(filename) as f:
+            if next(f, None) is None:
+                raise ValueError(f"{filename}: empty file")
+            for lineno, line in enumerate(f, start=2):
+                line = line.split("#", 1)[0].strip()  # Skip comments and blank lines
+                if not line:
+                    continue
+                try:
+                    levels.append(float(line.split(",")[1]))
+                except (IndexError, ValueError):
+                    raise ValueError(f"{filename}:{lineno}: expected 'freq,level', got {line!r}") from None
+        if len(levels) != len(self.octave_bands):
+            raise ValueError(f"{filename}: expected {len(self.octave_bands)} levels, got {len(levels)}")
+        self.data = np.array(levels, dtype=float)
 
     def save(self, filename):
         if self.data is None:
             raise ValueError("No data")
-        x_arr = self.octave_bands
-        y_arr = self.data
-        savedata = np.column_stack((x_arr, y_arr))
-        np.savetxt(filename, savedata, delimiter=",", header="freq Hz,Noise dB", comments='', fmt="%.2f")
+        with open(filename, "w") as f:
+            f.write("freq Hz,Noise dB\n")
+            f.writelines(f"{band:.2f},{level:.2f}\n" for band, level in zip(self.octave_bands, self.data))
 
     def calculate(self):
         if self.data is None:
             raise ValueError("No input data.")
-        # Set boolean matrix of comparison of data and NC curve at each frequency
-        self.lt_NC = (self.data < self.level_mat)  # Boolean matrix of the condition Data < NC plot
-        self.gt_NC = (self.data >= self.level_mat)  # Boolean matrix of the condition Data >= NC plot
+        if np.shape(self.data) != (len(self.octave_bands),):
+            raise ValueError(f"Expected data of shape ({len(self.octave_bands)},), got {np.shape(self.data)}.")
+        band_rows = self._band_rows(self.data)
+        gt_NC = np.arange(len(self.levels))[:, None] < band_rows  # Boolean matrix of the condition Data >= NC plot
+        # 1 bit per cell, first cell in the most significant bit (packbits padding shifted out)
+        self._gt_bits = int.from_bytes(np.packbits(gt_NC).tobytes(), "big") >> (-gt_NC.size % 8)
 
-        # Find NC level
-        self.all_lt_NC_rows = np.where(np.all(self.lt_NC, axis=1))[0]  # Row indecies where all True in a row
-        min_NC_row = self.all_lt_NC_rows.min()  # Minimum row index
+        # Find NC level: first row where data is below the curve at all frequencies
+        min_NC_row = int(band_rows.max())
+        if min_NC_row == len(self.levels):
+            raise ValueError(f"Data exceeds {self.levels[-1]}.")
         self.nc_level = self.levels[min_NC_row]  # Name of the maximum noise level
 
-        # Find frequencies of maximum noise
-        self.gt_NC_idx = np.where(self.gt_NC)
-        max_row = self.gt_NC_idx[0].max()
-        self.freq_at_max_level = np.where(self.gt_NC_idx[0] == max_row)[0]
-        self.freqs = self.gt_NC_idx[1][self.freq_at_max_level]
+        # Find frequencies of maximum noise (bands reaching the row just below the NC level)
+        if min_NC_row > 0:
+            self.freqs = np.flatnonzero(band_rows == min_NC_row)
+        else:
+            self.freqs = np.array([], dtype=int)
     
+    def calculate_batch(self, data_matrix):
+        """
+        Estimate NC levels of many measurements at once.
+        data_matrix is an array of shape (measurements, octave bands).
+        Returns the row index into levels for each measurement.
+        Agrees with calculate() for each row (python -m doctest NC_criteria.py):
+
+        >>> nc = NC_table(loadfile="test_data.csv")
+        >>> measurements = [list(nc.data), list(nc.data - 10), [20.0] * 8]
+        >>> batch = [nc.levels[row] for row in nc.calculate_batch(measurements)]
+        >>> single = []
+        >>> for data in measurements:
+        ...     nc.data = np.array(data)
+        ...     nc.calculate()
+        ...     single.append(nc.nc_level)
+        >>> batch == single, batch
+        (True, ['NC-50', 'NC-40', 'NC-25'])
+        >>> nc.calculate_batch(np.empty((0, 8))).shape
+        (0,)
+        >>> nc.calculate_batch(measurements + [[80.0] * 8])
+        Traceback (most recent call last):
+            ...
+        ValueError: Data exceeds NC-60.
+        """
+        data_matrix = np.asarray(data_matrix, dtype=float)
+        if data_matrix.ndim != 2 or data_matrix.shape[1] != len(self.octave_bands):
+            raise ValueError(f"Expected data of shape (n, {len(self.octave_bands)}), got {data_matrix.shape}.")
+        # Band-major layout so that each band of all measurements is contiguous,
+        # then fold the per-band counts into a running maximum
+        bands = np.asfortranarray(data_matrix)
+        nc_rows = np.searchsorted(self.level_mat[:, 0], bands[:, 0], side="right")
+        for j in range(1, bands.shape[1]):
+            np.maximum(nc_rows, np.searchsorted(self.level_mat[:, j], bands[:, j], side="right"), out=nc_rows)
+        if (nc_rows == len(self.levels)).any():
+            raise ValueError(f"Data exceeds {self.levels[-1]}.")
+        return nc_rows
+
+    def _band_rows(self, data):
+        """
+        Count the NC curves at or below a single measurement in each band, by binary search.
+        NC curves rise monotonically in every band, so each column is already sorted.
+        data must hold exactly one level per octave band (checked by calculate()),
+        otherwise zip() would silently drop bands.
+        """
+        return np.array([np.searchsorted(column, level, side="right")
+                         for column, level in zip(self.level_mat.T, data)])
+
     def hr(self):
-        print('-' * 72)
+        print(_HR)
 
     def print_text_table(self):
-        """ テキストテーブルの出力 """
-        print(f"{'':>7}", end="")
-        print(" ".join(f"{band:>6}" for band in self.octave_bands))
-        # print data
+        """ テキストテーブルの出力 (returns the table as a string) """
+        rows = [_HEADER]
+        # data row
         if self.data is not None:
-            self.hr()
-            print(f"{'Data':>7}", end="")
-            print(" ".join(f"{data:>6}" for data in self.data))
-            self.hr()
-        # print rows with labels
-        for i, level in enumerate(self.levels):
-            print(f"{level:>7}", end="")
-            for j, value in enumerate(self.level_mat[i]):
-                if self.gt_NC is None:
-                    print(f"{value:7.1f} ", end="")
-                else:
-                    if self.gt_NC[i][j]==1:
-                        f = '*'
-                    else:
-                        f = ' '
-                    print(f"{value:6.1f}{f}", end="")                        
-            print()
-    
-    def plot_mat(self, overlay_ar=None, filename=None):
-        """ グラフのプロット """
+            rows.append(_HR)
+            rows.append(f"{'Data':>7}" + " ".join(f"{data:>6}" for data in self.data))
+            rows.append(_HR)
+        # rows with labels, '*' where data >= NC curve
+        flags = format(self._gt_bits, f"0{_LEVEL_TEXT.size}b").translate(_FLAG_CHARS)
+        n_bands = _LEVEL_TEXT.shape[1]
+        for i, (prefix, row) in enumerate(zip(_ROW_PREFIXES, _LEVEL_TEXT)):
+            rows.append(prefix + "".join(v + f for v, f in zip(row, flags[i * n_bands:(i + 1) * n_bands])))
+        return "\n".join(rows)
+
+    def plot_mat(self, overlay_ar=None, filename=None, cache_dir=None):
+        """
+        グラフのプロット
+        With cache_dir, the plot is only written to filename: a previous rendering of
+        the same plot is copied from cache_dir and nothing is drawn or displayed.
+        """
+        if cache_dir is not None:
+            if filename is None:
+                raise ValueError("cache_dir requires filename.")
+            # Reuse a previous rendering of the same curves, data, layout and matplotlib
+            import matplotlib
+            key_src = f"{_PLOT_VERSION},{_PLOT_DPI},{matplotlib.__version__};".encode() + self.level_mat.tobytes()
+            if overlay_ar is not None:
+                key_src += np.asarray(overlay_ar, dtype=float).tobytes()
+            key = hashlib.blake2b(key_src, digest_size=16).hexdigest()
+            cached = os.path.join(cache_dir, f"nc_cache_{key}.png")
+            if os.path.exists(cached):
+                shutil.copyfile(cached, filename)
+                return
+
+        import matplotlib.pyplot as plt  # Imported here so that non-plotting use skips matplotlib
+
+        if cache_dir is not None:
+            fig = plt.figure()  # Start from an empty figure so the cached image matches its key
+
         x_arr = self.octave_bands
         y_mat = self.level_mat
 
-        # NCカーブをプロット
-        for i in range(y_mat.shape[0]):
-            plt.plot(x_arr[:y_mat.shape[1]], y_mat[i], label=self.levels[i])  # NCプロット
-            plt.text(x_arr[-1] * 1.4, y_mat[i, -1], self.levels[i], va='center')  # NC名を手動で配置
+        # NCカーブをプロット (all curves in one call)
+        lines = plt.plot(x_arr[:y_mat.shape[1]], y_mat.T)  # NCプロット
+        label_x = x_arr[-1] * 1.4
+        for line, level, y in zip(lines, self.levels, y_mat[:, -1]):
+            line.set_label(level)
+            plt.text(label_x, y, level, va='center')  # NC名を手動で配置
 
         if overlay_ar is not None:  # 追加プロットがあれば描画
             plt.plot(x_arr[:y_mat.shape[1]], overlay_ar, marker='s', label="Data")
@@ -173,7 +299,20 @@ class NC_table:
 
         # グラフの表示・保存
         if filename is not None:
-            plt.savefig(filename, dpi=300, bbox_inches='tight')
+            plt.savefig(filename, dpi=_PLOT_DPI, bbox_inches='tight')
+            if cache_dir is not None:
+                plt.close(fig)
+                os.makedirs(cache_dir, exist_ok=True)
+                # Write under a unique temporary name and rename, so an interrupted or
+                # concurrent run never leaves a partial PNG under a valid key
+                fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "wb") as dst, open(filename, "rb") as src:
+                        shutil.copyfileobj(src, dst)
+                    os.replace(tmp, cached)
+                except BaseException:
+                    os.remove(tmp)
+                    raise
         else:
             plt.show()
 
@@ -187,4 +326,4 @@ if __name__ == "__main__":
         nc.input_levels()
     
     if nc.data is not None:
-        nc.calculate_levels()
\ No newline at end of file
+        nc.calculate_levels(cache_dir=_PLOT_CACHE_DIR)
\ No newline at end of file